@@ -151,10 +151,10 @@ async function getWeeklyMessageCounts(sourceChannel) {
     const cutoffTime = Date.now() - ONE_WEEK_MS;
 
     let lastId;
-    let fetchedMessages = 0;
+    let reachedCutoff = false;
 
-    // Fetch messages until we hit the cutoff time (max 5000 messages to prevent excessive API calls)
-    while (fetchedMessages < 5000) {
+    // Fetch messages until we hit the cutoff time or run out of history
+    while (true) {
         const messages = await sourceChannel.messages.fetch({ limit: 100, before: lastId });
 
         if (messages.size === 0) break;
@@ -162,7 +162,7 @@ async function getWeeklyMessageCounts(sourceChannel) {
         for (const message of messages.values()) {
             if (message.createdTimestamp < cutoffTime) {
                 // Stop iterating when we reach messages older than 7 days
-                fetchedMessages = 5001; // Flag to exit outer loop
+                reachedCutoff = true;
                 break;
             }
 
@@ -174,10 +174,10 @@ async function getWeeklyMessageCounts(sourceChannel) {
             }
         }
 
-        if (fetchedMessages > 5000) break;
+        // A short page means the channel has no older messages, so skip the empty follow-up fetch
+        if (reachedCutoff || messages.size < 100) break;
 
         lastId = messages.last().id;
-        fetchedMessages += messages.size;
     }
 
     return messageCounts;
@@ -1,29 +1,189 @@
 import discord
 from discord import app_commands, Intents, Client
-from discord.ext import tasks 
 from datetime import datetime, timedelta, timezone
 import asyncio
+import logging
+from logging.handlers import QueueHandler, QueueListener
 import os
+import queue
+import random
+import sqlite3
+import tempfile
+import time
 import json 
 import collections
 from typing import Optional
 
+# orjson is optional: it is several times faster than the stdlib json module, but the bot
+# falls back to json when it is not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# --- Logging ---
+# All output goes through this logger. Records are queued and written by a QueueListener
+# thread, so stdout writes never block the event loop.
+log = logging.getLogger('leaderboard')
+
+
+def setup_logging() -> QueueListener:
+    """Routes every log record (ours and discord.py's) through a queue to a stream handler."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('[{asctime}] [{levelname:<8}] {name}: {message}', '%Y-%m-%d %H:%M:%S', style='{'))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+log_listener = setup_logging()
+
 # --- Configuration for Persistence ---
 # File to store the bot's configuration (timers, channel IDs, role IDs)
 CONFIG_FILE = 'leaderboard_config.json'
+# Messages read per run when falling back to the history fetch. None reads the whole window; an
+# optional "history_limit" key in the config caps it (the newest messages are dropped past the cap)
+DEFAULT_HISTORY_LIMIT = None
+# Maximum number of role edits in flight at once during a leaderboard run
+ROLE_EDIT_CONCURRENCY = 5
+# Used by the POSIX-timestamp scheduling arithmetic
+SECONDS_PER_DAY = 86400
+# Length of the leaderboard counting window
+SEVEN_DAYS = timedelta(days=7)
+UTC = timezone.utc
+# Rate-limit retries for a history fetch before giving up, and the cap on the backoff delay (seconds)
+HISTORY_RETRY_ATTEMPTS = 5
+HISTORY_RETRY_MAX_DELAY = 60
+# Number of author ids collected before each Counter.update during a history fetch
+COUNT_BATCH_SIZE = 1000
+# SQLite database holding the live message log of the source channel (see MessageStore)
+MESSAGE_DB_FILE = 'leaderboard_messages.db'
+# Seconds between flushes of buffered live messages to the database
+LIVE_FLUSH_INTERVAL = 5
+# How far before the last flush a restart backfill starts, to catch events that were still in flight
+BACKFILL_MARGIN_SNOWFLAKE = 60_000 << 22
+# Keys that must be present before the scheduler can run the job
+REQUIRED_CONFIG_KEYS = ("next_run_timestamp_gmt", "leaderboard_channel_id", "source_channel_id", "top_user_role_id", "top_users_count", "guild_id")
+
+
+def dumps_config(config: dict) -> bytes:
+    """Serializes the configuration to indented JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(config, option=orjson.OPT_INDENT_2)
+    return json.dumps(config, indent=4).encode()
+
+
+def loads_config(data: bytes) -> dict:
+    """Parses configuration JSON bytes (orjson.JSONDecodeError subclasses json.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class MessageStore:
+    """
+    SQLite log of (message id, author id) for the tracked source channel, so live counts survive
+    restarts. `tracking` records since when the log is complete (`since`) and up to when every
+    message is known to have been stored (`seen_until`), both as snowflakes.
+    All methods block; the client calls them through asyncio.to_thread under a lock.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (message_id INTEGER PRIMARY KEY, channel_id INTEGER NOT NULL, author_id INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS tracking (channel_id INTEGER PRIMARY KEY, since INTEGER NOT NULL, seen_until INTEGER NOT NULL);
+            """
+        )
+
+    def get_tracking(self, channel_id):
+        """Returns (since, seen_until) for `channel_id`, or None if it is not being tracked."""
+        return self.conn.execute('SELECT since, seen_until FROM tracking WHERE channel_id = ?', (channel_id,)).fetchone()
+
+    def start_tracking(self, channel_id, since):
+        """Forgets all stored messages and starts a fresh log for `channel_id` from the snowflake `since`."""
+        with self.conn:
+            self.conn.execute('DELETE FROM messages')
+            self.conn.execute('DELETE FROM tracking')
+            self.conn.execute('INSERT INTO tracking VALUES (?, ?, ?)', (channel_id, since, since))
+
+    def write(self, channel_id, inserts, deletes, seen_until, prune_before):
+        """Applies buffered inserts/deletes, advances `seen_until` and drops rows at or before `prune_before`."""
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO messages VALUES (?, ?, ?)', inserts)
+            self.conn.executemany('DELETE FROM messages WHERE message_id = ?', ((message_id,) for message_id in deletes))
+            if seen_until is not None:
+                self.conn.execute('UPDATE tracking SET seen_until = MAX(seen_until, ?) WHERE channel_id = ?', (seen_until, channel_id))
+            self.conn.execute('DELETE FROM messages WHERE message_id <= ?', (prune_before,))
+
+    def top_authors(self, channel_id, after_id, limit):
+        """Returns up to `limit` (author id, count) pairs for messages after `after_id`, most active first (ties: earliest poster)."""
+        return self.conn.execute(
+            'SELECT author_id, COUNT(*) AS c FROM messages WHERE channel_id = ? AND message_id > ? '
+            'GROUP BY author_id ORDER BY c DESC, MIN(message_id) LIMIT ?',
+            (channel_id, after_id, limit)
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+# --- Leaderboard Message ---
+# Emoji and award line per rank (index 0 is rank 1). Awards are only specified for the top 3;
+# /setup-auto-leaderboard caps the count at 10.
+RANK_EMOJIS = (":first_place:", ":second_place:", ":third_place:") + tuple(f"#{rank}:" for rank in range(4, 11))
+RANK_AWARDS = ("-# Gets 50k unb in cash", "-# Gets 25k unb in cash", "-# Gets 10k unb in cash") + tuple(f"-# Congrats on reaching rank {rank}!" for rank in range(4, 11))
+
+# Role paragraph of the announcement, depending on whether the role edits could run
+ROLE_GRANTED_TEXT = "All of the top three members have been granted the role:\n**{role_name}**"
+ROLE_NOT_GRANTED_TEXT = "The role **{role_name}** could not be granted automatically this week."
+
+# Weekly announcement, filled in with str.format by run_leaderboard_job
+LEADERBOARD_TEMPLATE = """Hello fellas, 
+We're back with the weekly leaderboard update!! <:Pika_Think:1444211873687011328>
+
+Here are the top {top_count} active members past week–
+{leaderboard_text}
+
+{role_text}
+
+Top 1 can change their server nickname once. Top 1 & 2 can have a custom role with name and colour based on their requests. Contact <@1193415556402008169> (<@&1405157360045002785>) within 24 hours to claim your awards.
+"""
+
 
 # --- Bot Setup ---
 
 # Set your bot token here. Using an environment variable is best practice.
 TOKEN = os.environ.get('DISCORD_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE') 
 if TOKEN == 'YOUR_BOT_TOKEN_HERE':
-    print("WARNING: Please set the DISCORD_BOT_TOKEN environment variable or replace 'YOUR_BOT_TOKEN_HERE' with your actual bot token.")
+    log.warning("Please set the DISCORD_BOT_TOKEN environment variable or replace 'YOUR_BOT_TOKEN_HERE' with your actual bot token.")
+
+# Guild that slash commands are synced to on startup (the production server by default). Set
+# SYNC_GUILD_ID to an empty string to skip the startup sync entirely. The old DEV_GUILD_ID name
+# is still read so existing deployments keep working.
+_sync_guild_setting = os.environ.get('SYNC_GUILD_ID', os.environ.get('DEV_GUILD_ID', '1349281907765936188')).strip()
+try:
+    SYNC_GUILD_ID = int(_sync_guild_setting) if _sync_guild_setting else None
+except ValueError:
+    log.warning("Ignoring invalid SYNC_GUILD_ID %r: it must be a numeric guild id. Slash commands will not be synced on startup.", _sync_guild_setting)
+    SYNC_GUILD_ID = None
 
 # Intents required:
 intents = Intents.default()
 # Required for fetching messages in channels
 intents.messages = True
-intents.message_content = True 
+# Message text is never read (only authors are counted), so skip the privileged content intent
+# and let Discord send smaller message payloads
+intents.message_content = False
 # Required for guild management and interaction
 intents.guilds = True
 # MANDATORY for role assignment and fetching guild members
@@ -34,42 +194,228 @@ class LeaderboardClient(Client):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
         self.config: Optional[dict] = None # Stores the loaded configuration
+        self._config_loaded = False # True once load_config has run (even if no file was found)
+        self._last_saved_payload: Optional[bytes] = None # Last bytes written to CONFIG_FILE
+        self.config_changed = asyncio.Event() # Set to wake the scheduler after a config change
+        self._scheduler_task: Optional[asyncio.Task] = None
+        # Live message log for the source channel, fed by on_message (see resume_live_counts)
+        self.message_store: Optional[MessageStore] = None
+        self._store_lock = asyncio.Lock() # Serializes MessageStore calls made from worker threads
+        self._live_channel_id: Optional[int] = None
+        self._live_since: Optional[int] = None # Snowflake after which every message has been stored
+        self._gateway_connected = False # True from on_ready/on_resumed until on_disconnect
+        self._live_backfills = 0 # Number of resume_live_counts calls still catching the log up
+        self._pending_inserts = [] # Buffered (message id, channel id, author id) rows
+        self._pending_deletes = [] # Buffered deleted message ids
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def setup_hook(self):
+        # Runs once per process (unlike on_ready, which fires again on every reconnect).
+        # Guild-scoped syncs propagate instantly and avoid the heavier global sync rate limit.
+        if SYNC_GUILD_ID:
+            try:
+                guild_to_sync = discord.Object(id=SYNC_GUILD_ID)
+                self.tree.copy_global_to(guild=guild_to_sync)
+                await self.tree.sync(guild=guild_to_sync)
+                log.info("Successfully synced commands to guild %s.", SYNC_GUILD_ID)
+            except Exception as e:
+                log.error("Failed to sync commands to guild %s: %s", SYNC_GUILD_ID, e)
+
+        self.message_store = await asyncio.to_thread(MessageStore, MESSAGE_DB_FILE)
+        self._flush_task = asyncio.create_task(self.live_flush_loop())
+
+        # Start the background scheduler once; it waits for the client to be ready itself
+        self._scheduler_task = asyncio.create_task(self.leaderboard_scheduler())
+
+    async def close(self):
+        # Stop the background tasks first so neither touches the store while it is being closed
+        tasks = [task for task in (self._flush_task, self._scheduler_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Persist buffered live messages, then close the store under the lock so no in-flight call
+        # (e.g. a backfill started from on_ready) is still using the connection
+        if self.message_store is not None:
+            await self.flush_live_messages()
+            async with self._store_lock:
+                await asyncio.to_thread(self.message_store.close)
+                self.message_store = None
+        await super().close()
 
     async def on_ready(self):
-        # --- TEMPORARY SYNC FIX ---
-        # Forces the bot to immediately sync commands to your specific guild.
-        # This solves the issue of commands not appearing instantly.
-        # Once commands appear, you can remove these two lines:
+        log.info('Logged in as %s (ID: %s)', self.user, self.user.id)
+        self._gateway_connected = True
+        if not self._config_loaded:
+            await self.load_config()
+        # on_ready means a new gateway session (resumes fire on_resumed instead), so messages may
+        # have been missed while disconnected: catch the live log up from the channel history
+        await self.resume_live_counts()
+        # Let the scheduler pick up the freshly loaded config
+        self.config_changed.set()
+
+    # --- Live Message Counting ---
+
+    async def on_message(self, message):
+        # Called for every message the bot can see: a single int comparison rejects other channels
+        if message.channel.id != self._live_channel_id or message.author.bot:
+            return
+        self._pending_inserts.append((message.id, message.channel.id, message.author.id))
+
+    async def on_raw_message_delete(self, payload):
+        # Deleted messages no longer appear in the history, so stop counting them here too
+        if payload.channel_id == self._live_channel_id:
+            self._pending_deletes.append(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload):
+        if payload.channel_id == self._live_channel_id:
+            self._pending_deletes.extend(payload.message_ids)
+
+    async def on_disconnect(self):
+        # Stop advancing seen_until: events may be missed until the session resumes or restarts
+        self._gateway_connected = False
+
+    async def on_resumed(self):
+        # A resumed session replays the events missed while disconnected
+        self._gateway_connected = True
+
+    def live_log_complete(self):
+        """Whether every message up to now is in the live log: gateway events are flowing and no backfill is pending."""
+        return self._gateway_connected and self._live_backfills == 0
+
+    async def live_flush_loop(self):
+        """Writes buffered live messages to the database every LIVE_FLUSH_INTERVAL seconds."""
+        while not self.is_closed():
+            await asyncio.sleep(LIVE_FLUSH_INTERVAL)
+            try:
+                await self.flush_live_messages()
+            except Exception:
+                log.exception("Failed to flush live messages to the database.")
+
+    async def flush_live_messages(self, prune_before: Optional[int] = None):
+        """
+        Writes buffered inserts/deletes and, while the log is complete, records that it is complete up
+        to now. Rows at or before the snowflake `prune_before` (default: the start of the window as
+        of now) are dropped.
+        """
+        if self._live_channel_id is None:
+            return
+        inserts, self._pending_inserts = self._pending_inserts, []
+        deletes, self._pending_deletes = self._pending_deletes, []
+        now = discord.utils.utcnow()
+        seen_until = discord.utils.time_snowflake(now) if self.live_log_complete() else None
+        if prune_before is None:
+            prune_before = discord.utils.time_snowflake(now - SEVEN_DAYS)
+        await self._store_call('write', self._live_channel_id, inserts, deletes, seen_until, prune_before)
+
+    async def start_live_counts(self, channel_id):
+        """Starts a fresh live log for `channel_id` from now on; runs fetch history until it covers a full window."""
+        since = discord.utils.time_snowflake(discord.utils.utcnow())
+        self._live_channel_id = channel_id
+        self._live_since = since
+        self._pending_inserts.clear()
+        self._pending_deletes.clear()
+        await self._store_call('start_tracking', channel_id, since)
+
+    async def resume_live_counts(self):
+        """
+        Re-attaches the live log for the configured source channel after a (re)connect. Messages
+        posted while the bot was offline are backfilled from the history after the stored
+        seen_until; if that is older than the window, the log starts over. Deletions missed while
+        offline are not reconciled (see live_counts_cover).
+        """
+        # Until the backfill is done the log may be missing messages, whatever the gateway state
+        self._live_backfills += 1
         try:
-             # Using the guild ID from the configuration (1349281907765936188)
-            guild_id_to_sync = discord.Object(id=1349281907765936188) 
-            await self.tree.sync(guild=guild_id_to_sync)
-            print("Successfully synced commands to the configured guild.")
-        except Exception as e:
-            print(f"Failed to sync commands to the specific guild: {e}")
-        # --- END TEMPORARY SYNC FIX ---
+            await self._backfill_live_counts()
+        finally:
+            self._live_backfills -= 1
+        await self.flush_live_messages()
+
+    async def _backfill_live_counts(self):
+        """Body of resume_live_counts: picks up the stored log and backfills it, or starts a fresh one."""
+        channel_id = self.config.get('source_channel_id') if self.config else None
+        if channel_id is None:
+            self._live_channel_id = None
+            return
+
+        tracking = await self._store_call('get_tracking', channel_id)
+        window_start = discord.utils.time_snowflake(discord.utils.utcnow() - SEVEN_DAYS)
+        channel = self.get_channel(channel_id)
+        if tracking is None or tracking[1] < window_start or channel is None:
+            await self.start_live_counts(channel_id)
+            return
 
-        print(f'Logged in as {self.user} (ID: {self.user.id})')
-        await self.load_config()
-        # Start the background task after loading the config
-        self.leaderboard_scheduler.start() 
+        # Buffer new events right away; INSERT OR IGNORE dedupes them against the backfill
+        self._live_channel_id = channel_id
+        self._live_since = tracking[0]
+        try:
+            async for message in self.history_with_retry(channel, after=discord.Object(id=tracking[1] - BACKFILL_MARGIN_SNOWFLAKE)):
+                if not message.author.bot:
+                    self._pending_inserts.append((message.id, channel_id, message.author.id))
+        except discord.HTTPException as e:
+            log.error("Could not backfill live message counts from %s: %s. Starting a fresh log.", channel, e)
+            await self.start_live_counts(channel_id)
+
+    def live_counts_cover(self, channel_id, after_id):
+        """
+        Whether the live log holds every message in `channel_id` newer than the snowflake `after_id`.
+        Deletions are only seen while connected: a message deleted while the bot was offline (or
+        during a disconnect that did not resume) stays in the log, since the backfill only adds
+        messages. Live counts can therefore be slightly higher than a history fetch would give.
+        """
+        return (
+            self.live_log_complete()
+            and channel_id == self._live_channel_id
+            and self._live_since is not None
+            and self._live_since <= after_id
+        )
+
+    async def live_top_authors(self, after_id, top_count):
+        """Returns the `top_count` most active (author id, count) pairs after the snowflake `after_id` from the live log."""
+        # Prune at the caller's window start rather than "now - 7 days", which is later and would drop
+        # messages the history fetch would still count
+        await self.flush_live_messages(prune_before=after_id)
+        top_authors = await self._store_call('top_authors', self._live_channel_id, after_id, top_count)
+        if top_authors is None:
+            raise RuntimeError("The live message store is closed.")
+        return top_authors
+
+    async def _store_call(self, method, *args):
+        """
+        Runs the MessageStore `method` in a worker thread under the store lock; returns None once the
+        store has been closed. If the caller is cancelled, the lock is held until the thread finishes,
+        so close() never shuts the connection underneath a running call.
+        """
+        async with self._store_lock:
+            if self.message_store is None:
+                return None
+            call = asyncio.ensure_future(asyncio.to_thread(getattr(self.message_store, method), *args))
+            try:
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                await asyncio.wait([call])
+                raise
 
     async def load_config(self):
         """Loads configuration from local JSON file."""
         try:
             if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r') as f:
-                    self.config = json.load(f)
-                    print(f"Configuration loaded from {CONFIG_FILE}.")
+                with open(CONFIG_FILE, 'rb') as f:
+                    self.config = loads_config(f.read())
+                    log.info("Configuration loaded from %s.", CONFIG_FILE)
             else:
                 self.config = None
-                print(f"No configuration file found at {CONFIG_FILE}. Please run /setup-auto-leaderboard or create it manually.")
+                log.warning("No configuration file found at %s. Please run /setup-auto-leaderboard or create it manually.", CONFIG_FILE)
         except json.JSONDecodeError as e:
-            print(f"Error loading config from file: {e}. The file might be empty or corrupted. Delete it and run /setup-auto-leaderboard.")
+            log.error("Error loading config from file: %s. The file might be empty or corrupted. Delete it and run /setup-auto-leaderboard.", e)
             self.config = None
         except Exception as e:
-            print(f"General error loading config from file: {e}")
+            log.error("General error loading config from file: %s", e)
             self.config = None
+        finally:
+            # Loaded or confirmed missing/unreadable: don't hit the disk again until a restart
+            self._config_loaded = True
 
     async def save_config(self):
         """Saves current configuration to local JSON file."""
@@ -77,46 +423,116 @@ class LeaderboardClient(Client):
             return 
 
         try:
-            with open(CONFIG_FILE, 'w') as f:
-                # Use asyncio.to_thread to move file I/O operations out of the main event loop
-                await asyncio.to_thread(json.dump, self.config, f, indent=4)
-            print(f"Configuration saved to {CONFIG_FILE}.")
+            # Serialize on the loop (the config is tiny), then move the blocking open/write
+            # out of the main event loop with asyncio.to_thread
+            data = dumps_config(self.config)
+            if data == self._last_saved_payload:
+                # Nothing changed since the last save; skip the write
+                return
+            await asyncio.to_thread(self._write_config_file, data)
+            self._last_saved_payload = data
+            log.info("Configuration saved to %s.", CONFIG_FILE)
         except Exception as e:
-            print(f"Error saving config to file: {e}")
+            log.error("Error saving config to file: %s", e)
+
+    @staticmethod
+    def _write_config_file(data):
+        """
+        Writes the serialized configuration to CONFIG_FILE (blocking; run in a thread).
+        Writes to a uniquely named temporary file in the same directory first, fsyncs it and swaps it
+        in with os.replace, so a crash or power loss mid-write never leaves a truncated config behind.
+        """
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(CONFIG_FILE) or '.', prefix='.leaderboard_config.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file owner-only (0600); keep the existing config's permissions instead
+            try:
+                mode = os.stat(CONFIG_FILE).st_mode & 0o777
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_file, mode)
+            os.replace(tmp_file, CONFIG_FILE)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
 
     # --- Utility Functions ---
 
-    def get_next_sunday_430am_gmt(self):
-        """Calculates the timestamp for the next Sunday at 4:30 AM UTC (GMT)."""
-        now = datetime.now(timezone.utc)
-        
-        # Calculate days until next Sunday (Sunday is weekday 6, Monday is 0)
-        days_to_sunday = (6 - now.weekday() + 7) % 7
-        if days_to_sunday == 0:
-            # If it's already Sunday, check if 4:30 AM has passed
-            if now.hour > 4 or (now.hour == 4 and now.minute >= 30):
-                # Target time passed, schedule for next Sunday
-                days_to_sunday = 7
-        
-        # Calculate the next Sunday date
-        next_sunday = now + timedelta(days=days_to_sunday)
-        
-        # Set the time to 4:30 AM UTC
-        target_time = next_sunday.replace(hour=4, minute=30, second=0, microsecond=0, tzinfo=timezone.utc)
-        
-        # If the target time is in the past (only possible if days_to_sunday was 0), push to next week
-        if target_time <= now:
-            target_time += timedelta(weeks=1)
-            
-        return target_time.timestamp()
+    def get_next_sunday_430am_gmt(self, now: Optional[float] = None):
+        """Calculates the timestamp for the next Sunday at 4:30 AM UTC (GMT) after the POSIX timestamp `now` (defaults to the current time)."""
+        if now is None:
+            now = time.time()
+
+        # Plain arithmetic on the POSIX timestamp. Day 0 (1970-01-01) was a Thursday, so the
+        # weekday (Monday is 0, Sunday is 6) of day N is (N + 3) % 7.
+        days = int(now // SECONDS_PER_DAY)
+        days_to_sunday = (6 - (days + 3) % 7) % 7
+        target = (days + days_to_sunday) * SECONDS_PER_DAY + 4 * 3600 + 30 * 60
+
+        # Already Sunday and 4:30 AM has passed: schedule for next Sunday
+        if target <= now:
+            target += 7 * SECONDS_PER_DAY
+
+        return float(target)
+
+    async def history_with_retry(self, channel, *, after, limit=None):
+        """
+        Yields up to `limit` messages of the channel history after `after` (oldest first), retrying
+        429s up to HISTORY_RETRY_ATTEMPTS times. Each retry waits for Retry-After (or an exponential
+        backoff when the header is missing) plus a little jitter. On a rate limit the fetch resumes
+        after the last yielded message, so nothing is counted twice.
+        """
+        for attempt in range(HISTORY_RETRY_ATTEMPTS):
+            try:
+                async for message in channel.history(limit=limit, after=after, oldest_first=True):
+                    after = message
+                    if limit is not None:
+                        limit -= 1
+                    yield message
+                return
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == HISTORY_RETRY_ATTEMPTS - 1:
+                    raise
+                retry_after = e.response.headers.get('Retry-After')
+                delay = float(retry_after) if retry_after is not None else min(HISTORY_RETRY_MAX_DELAY, 2 ** attempt)
+                delay += random.uniform(0, 0.5)
+                log.warning("Rate limited while fetching history in %s. Retrying in %.1fs.", channel, delay)
+                await asyncio.sleep(delay)
+
+    async def update_member_roles(self, members, role, *, add, reason):
+        """
+        Adds (or removes) `role` for all `members` concurrently, with at most ROLE_EDIT_CONCURRENCY
+        requests in flight. Failures are logged per member and do not abort the other edits;
+        discord.py's HTTP client paces the requests on 429s.
+        """
+        semaphore = asyncio.Semaphore(ROLE_EDIT_CONCURRENCY)
+
+        async def edit(member):
+            async with semaphore:
+                if add:
+                    await member.add_roles(role, reason=reason)
+                else:
+                    await member.remove_roles(role, reason=reason)
 
-    async def run_leaderboard_job(self, guild_id, target_channel_id, source_channel_id, role_id, top_count, is_test=False):
+        results = await asyncio.gather(*(edit(m) for m in members), return_exceptions=True)
+
+        action = "assign role to" if add else "remove role from"
+        for member, result in zip(members, results):
+            if isinstance(result, Exception):
+                log.warning("Could not %s %s: %s", action, member.display_name, result)
+
+    async def run_leaderboard_job(self, guild_id, target_channel_id, source_channel_id, role_id, top_count, is_test=False, now: Optional[datetime] = None, history_limit=DEFAULT_HISTORY_LIMIT):
         """
         Core logic to fetch messages, calculate top users, assign roles, and send the message.
+        `now` is the reference time for the 7-day window; the scheduler passes the time it woke at.
+        At most `history_limit` messages are read from the source channel.
         """
         guild = self.get_guild(guild_id)
         if not guild:
-            print(f"Error: Guild with ID {guild_id} not found.")
+            log.error("Guild with ID %s not found.", guild_id)
             return
 
         target_channel = guild.get_channel(target_channel_id)
@@ -128,162 +544,206 @@ class LeaderboardClient(Client):
             if not target_channel: error_message += "Target Channel not found. "
             if not source_channel: error_message += "Source Channel not found. "
             if not role: error_message += "Role not found. "
-            print(error_message)
+            log.error(error_message)
             if is_test and target_channel:
                  await target_channel.send(f"❌ Leaderboard setup failed. Please check if the configured channels and role still exist. Details: {error_message}")
             return
 
+        # Check once, before any expensive work, that the bot can assign the role at all (below its
+        # top role, not managed or @everyone, Manage Roles granted) instead of letting every member
+        # edit fail individually. The leaderboard is still posted; only the role edits are skipped.
+        role_error = None
+        if not role.is_assignable():
+            role_error = f"❌ Error: The role **{role.name}** cannot be assigned by the bot. Make sure it is below the bot's highest role, is not managed by an integration, and that the bot has Manage Roles!"
+            log.error(role_error)
+
         # 1. Calculate time range (Past 7 days)
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        message_counts = collections.defaultdict(int)
+        if now is None:
+            now = datetime.now(UTC)
+        seven_days_ago = now - SEVEN_DAYS
+        # Convert the cutoff to a snowflake once, so every paginated request uses the same fixed bound
+        history_after = discord.Object(id=discord.utils.time_snowflake(seven_days_ago))
         
         status_channel = target_channel
+        # Test runs post one progress message and edit it when done, instead of sending a second one
+        status_message = None
         
         if is_test:
-            await status_channel.send(f"⏳ Starting leaderboard calculation from {source_channel.mention} for the past 7 days...")
-
-        # 2. Fetch messages and count
-        try:
-            # Fetch history since seven days ago.
-            async for message in source_channel.history(limit=None, after=seven_days_ago):
-                # Ignore messages from bots
-                if not message.author.bot:
-                    message_counts[message.author] += 1
-            
-            # Sort and get top users
-            sorted_users = sorted(message_counts.items(), key=lambda item: item[1], reverse=True)
-            top_members = sorted_users[:top_count]
-
-        except discord.errors.Forbidden:
-            error_msg = f"❌ Error: Bot does not have permissions to read history in {source_channel.mention}. Check permissions!"
-            print(error_msg)
-            await status_channel.send(error_msg)
-            return
-        except Exception as e:
-            error_msg = f"❌ An unexpected error occurred during message fetching: {e}"
-            print(error_msg)
-            await status_channel.send(error_msg)
-            return
+            status_message = await status_channel.send(f"⏳ Starting leaderboard calculation from {source_channel.mention} for the past 7 days...")
+
+        # 2. Count messages. The live log (fed by on_message) is used once it covers the whole
+        # window; otherwise fetch the channel history.
+        if self.live_counts_cover(source_channel.id, history_after.id):
+            top_members = await self.live_top_authors(history_after.id, top_count)
+        else:
+            message_counts = collections.Counter()
+            try:
+                # Fetch history since seven days ago. This loop runs once per message, so the author
+                # is looked up only once and ids are counted in batches by Counter.update (C loop).
+                author_ids = []
+                fetched = 0
+                async for message in self.history_with_retry(source_channel, after=history_after, limit=history_limit):
+                    fetched += 1
+                    author = message.author
+                    # Ignore messages from bots; key by the author's int id (cheap to hash, and
+                    # doesn't keep every author object alive)
+                    if author.bot:
+                        continue
+                    author_ids.append(author.id)
+                    if len(author_ids) >= COUNT_BATCH_SIZE:
+                        message_counts.update(author_ids)
+                        author_ids.clear()
+                message_counts.update(author_ids)
+
+                if history_limit is not None and fetched >= history_limit:
+                    # History is read oldest first, so the newest messages of the window were not counted
+                    log.warning(
+                        "History fetch in %s stopped at the history_limit of %s messages; any newer messages in the window were not counted. "
+                        "Raise history_limit in %s to count the whole window.", source_channel, history_limit, CONFIG_FILE
+                    )
+
+            except discord.errors.Forbidden:
+                error_msg = f"❌ Error: Bot does not have permissions to read history in {source_channel.mention}. Check permissions!"
+                log.error(error_msg)
+                await status_channel.send(error_msg)
+                return
+            except Exception as e:
+                error_msg = f"❌ An unexpected error occurred during message fetching: {e}"
+                log.error(error_msg)
+                await status_channel.send(error_msg)
+                return
+
+            # Get top users (most_common does a partial heap selection; top_count is at most 10)
+            top_members = message_counts.most_common(top_count)
 
         # 3. Role Management (Clear and Assign)
-        
-        # Get members who currently have the role
-        members_with_role = [member for member in guild.members if role in member.roles]
 
-        # Clear role from all current holders
-        for member in members_with_role:
-            try:
-                await member.remove_roles(role, reason="Weekly leaderboard role reset.")
-                await asyncio.sleep(0.5) 
-            except discord.HTTPException as e:
-                print(f"Could not remove role from {member.display_name}: {e}")
-
-        # Assign role to top members
-        for member_obj, _ in top_members:
-            # Get the full Member object
-            full_member = guild.get_member(member_obj.id)
-            if full_member:
-                try:
-                    await full_member.add_roles(role, reason="Weekly leaderboard top member award.")
-                    await asyncio.sleep(0.5)
-                except discord.HTTPException as e:
-                    print(f"Could not assign role to {full_member.display_name}: {e}")
+        if role_error is not None:
+            await status_channel.send(role_error)
+        else:
+            # role.members only sees cached members; make sure the guild is fully chunked so no holder is missed
+            if not guild.chunked:
+                await guild.chunk(cache=True)
+
+            # Get members who currently have the role (captured once; role.members walks the member cache)
+            members_with_role = role.members
+
+            # Only touch members whose status changes: repeat winners keep the role without any API call
+            current_holder_ids = {m.id for m in members_with_role}
+            winner_ids = {user_id for user_id, _ in top_members}
+
+            # Clear role from holders who are no longer in the top
+            to_remove = [m for m in members_with_role if m.id not in winner_ids]
+            await self.update_member_roles(to_remove, role, add=False, reason="Weekly leaderboard role reset.")
+
+            # Assign role to new top members (get the full Member objects, fetching any the cache misses)
+            to_add = []
+            for user_id in winner_ids - current_holder_ids:
+                member = guild.get_member(user_id)
+                if member is None:
+                    try:
+                        member = await guild.fetch_member(user_id)
+                    except discord.HTTPException as e:
+                        # NotFound: the member has left the guild since posting
+                        log.warning("Could not fetch member %s: %s", user_id, e)
+                        continue
+                to_add.append(member)
+            await self.update_member_roles(to_add, role, add=True, reason="Weekly leaderboard top member award.")
 
         # 4. Format and Send Leaderboard Message
         
         leaderboard_entries = []
-        emoji_map = {0: ":first_place:", 1: ":second_place:", 2: ":third_place:"}
-        
-        for i in range(top_count):
-            if i < len(top_members):
-                member, count = top_members[i]
-                
-                # Assign awards based on position (only up to top 3 are specified)
-                award = ""
-                if i == 0:
-                    award = "-# Gets 50k unb in cash"
-                elif i == 1:
-                    award = "-# Gets 25k unb in cash"
-                elif i == 2:
-                    award = "-# Gets 10k unb in cash"
-                else:
-                    award = f"-# Congrats on reaching rank {i+1}!"
+        append_entry = leaderboard_entries.append
 
-                # Use member.mention and the count of messages
-                leaderboard_entries.append(
-                    f"{emoji_map.get(i, f'#{i+1}:')} {member.mention} with more than **{count}** messages. \n{award}"
-                )
+        for i, (user_id, count) in enumerate(top_members):
+            # Mention by id (renders even if the member has since left) and the count of messages
+            # top_users_count can exceed the precomputed ranks if the config file was edited by hand
+            if i < len(RANK_EMOJIS):
+                emoji, award = RANK_EMOJIS[i], RANK_AWARDS[i]
             else:
-                # If there aren't enough members to fill the top spots
-                leaderboard_entries.append(f"#{i+1}: No eligible member found or insufficient data.")
-                
-        leaderboard_text = "\n".join(leaderboard_entries)
+                emoji, award = f"#{i+1}:", f"-# Congrats on reaching rank {i+1}!"
+            append_entry(f"{emoji} <@{user_id}> with more than **{count}** messages. \n{award}")
 
-        # Assemble the final message
-        final_message = f"""
-Hello fellas, 
-We're back with the weekly leaderboard update!! <:Pika_Think:1444211873687011328>
+        # If there aren't enough members to fill the top spots
+        for i in range(len(top_members), top_count):
+            append_entry(f"#{i+1}: No eligible member found or insufficient data.")
 
-Here are the top {top_count} active members past week–
-{leaderboard_text}
+        leaderboard_text = "\n".join(leaderboard_entries)
 
-All of the top three members have been granted the role:
-**{role.name}**
+        # Assemble the final message
+        role_text = (ROLE_GRANTED_TEXT if role_error is None else ROLE_NOT_GRANTED_TEXT).format(role_name=role.name)
+        final_message = LEADERBOARD_TEMPLATE.format(top_count=top_count, leaderboard_text=leaderboard_text, role_text=role_text)
 
-Top 1 can change their server nickname once. Top 1 & 2 can have a custom role with name and colour based on their requests. Contact <@1193415556402008169> (<@&1405157360045002785>) within 24 hours to claim your awards.
-        """
-        
         # Send the final message
         await target_channel.send(final_message)
         
-        if is_test:
-            await target_channel.send("✅ Test run complete. Roles have been updated and the message was sent.")
+        if status_message is not None:
+            if role_error is None:
+                await status_message.edit(content="✅ Test run complete. Roles have been updated and the message was sent.")
+            else:
+                await status_message.edit(content="⚠️ Test run complete. The message was sent, but roles were not updated (see the error above).")
             
-        print(f"Leaderboard job executed successfully in Guild {guild.id}.")
+        log.info("Leaderboard job executed successfully in Guild %s.", guild.id)
 
 
     # --- Background Task Scheduler (The restart-proof timer) ---
 
-    @tasks.loop(minutes=10) # Check every 10 minutes (or less, depending on desired precision)
     async def leaderboard_scheduler(self):
+        """
+        Sleeps until the configured next run time, runs the job, and reschedules.
+        Wakes early when the configuration changes (see self.config_changed) instead of polling.
+        """
         await self.wait_until_ready()
-        
-        # 1. Load config if not loaded (for persistence after restart)
-        if self.config is None:
-             await self.load_config()
-             if self.config is None:
-                # Still no config, skip this check cycle
-                return 
-        
-        # 2. Check for required configuration keys
-        required_keys = ["next_run_timestamp_gmt", "leaderboard_channel_id", "source_channel_id", "top_user_role_id", "top_users_count", "guild_id"]
-        if not all(k in self.config for k in required_keys):
-            print("Scheduler waiting for full configuration via /setup-auto-leaderboard.")
-            return
 
-        # 3. Check timer
-        next_run_ts = self.config['next_run_timestamp_gmt']
-        next_run_dt = datetime.fromtimestamp(next_run_ts, timezone.utc)
-        now = datetime.now(timezone.utc)
-        
-        if now >= next_run_dt:
-            print(f"Scheduled job running now: {now.isoformat()}. Target was: {next_run_dt.isoformat()}")
-            
+        while not self.is_closed():
+            self.config_changed.clear()
+
+            # 1. Load config if not loaded (for persistence after restart)
+            if not self._config_loaded:
+                await self.load_config()
+
+            # 2. Check for required configuration keys
+            if self.config is None or not all(k in self.config for k in REQUIRED_CONFIG_KEYS):
+                log.debug("Scheduler waiting for full configuration via /setup-auto-leaderboard.")
+                await self.config_changed.wait()
+                continue
+
+            # 3. Sleep until the timer is due (or the configuration changes)
+            # Compare raw POSIX timestamps; datetimes are only built for logging once the job is due
+            next_run_ts = self.config['next_run_timestamp_gmt']
+            now_ts = time.time()
+
+            if now_ts < next_run_ts:
+                try:
+                    await asyncio.wait_for(self.config_changed.wait(), timeout=next_run_ts - now_ts)
+                except asyncio.TimeoutError:
+                    pass
+                # Re-check against the wall clock (and any new configuration) before running
+                continue
+
+            now = datetime.fromtimestamp(now_ts, UTC)
+            next_run_dt = datetime.fromtimestamp(next_run_ts, UTC)
+            log.info("Scheduled job running now: %s. Target was: %s", now.isoformat(), next_run_dt.isoformat())
+
             # Run the job
-            await self.run_leaderboard_job(
-                guild_id=self.config['guild_id'],
-                target_channel_id=self.config['leaderboard_channel_id'],
-                source_channel_id=self.config['source_channel_id'],
-                role_id=self.config['top_user_role_id'],
-                top_count=self.config['top_users_count'],
-                is_test=False
-            )
-            
+            try:
+                await self.run_leaderboard_job(
+                    guild_id=self.config['guild_id'],
+                    target_channel_id=self.config['leaderboard_channel_id'],
+                    source_channel_id=self.config['source_channel_id'],
+                    role_id=self.config['top_user_role_id'],
+                    top_count=self.config['top_users_count'],
+                    is_test=False,
+                    now=now,
+                    history_limit=self.config.get('history_limit', DEFAULT_HISTORY_LIMIT)
+                )
+            except Exception:
+                log.exception("Scheduled leaderboard job failed.")
+
             # Update the next run time and save (ensures restart resilience)
-            self.config['next_run_timestamp_gmt'] = self.get_next_sunday_430am_gmt()
+            self.config['next_run_timestamp_gmt'] = self.get_next_sunday_430am_gmt(now_ts)
             await self.save_config()
-        # else: bot is sleeping, timer is correct
-                
+
 
     # --- Slash Commands ---
     
@@ -301,7 +761,7 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
         
         # 1. Calculate the initial next run time
         next_run_ts = self.get_next_sunday_430am_gmt()
-        next_run_dt = datetime.fromtimestamp(next_run_ts, timezone.utc)
+        next_run_dt = datetime.fromtimestamp(next_run_ts, UTC)
 
         # 2. Store configuration
         self.config = {
@@ -313,6 +773,10 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
             "next_run_timestamp_gmt": next_run_ts,
         }
         await self.save_config()
+        if from_channel.id != self._live_channel_id:
+            await self.start_live_counts(from_channel.id)
+        # Wake the scheduler so it sleeps until the new run time
+        self.config_changed.set()
 
         await interaction.followup.send(
             f"✅ **Leaderboard setup complete!**\n"
@@ -329,7 +793,7 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
         """Runs the job immediately using the stored configuration."""
         await interaction.response.defer(thinking=True)
         
-        if not self.config:
+        if not self._config_loaded:
             await self.load_config()
 
         if not self.config or not self.config.get("leaderboard_channel_id"):
@@ -346,7 +810,8 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
             source_channel_id=test_config['source_channel_id'],
             role_id=test_config['top_user_role_id'],
             top_count=test_config['top_users_count'],
-            is_test=True
+            is_test=True,
+            history_limit=test_config.get('history_limit', DEFAULT_HISTORY_LIMIT)
         )
         
         # The final confirmation is sent inside run_leaderboard_job
@@ -358,29 +823,27 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
         """Calculates and displays the time remaining until the next run."""
         await interaction.response.defer(thinking=True, ephemeral=True)
         
-        if not self.config:
+        if not self._config_loaded:
             await self.load_config()
 
         if not self.config or not self.config.get("next_run_timestamp_gmt"):
             await interaction.followup.send("❌ Leaderboard setup is incomplete. Please run `/setup-auto-leaderboard` first.", ephemeral=True)
             return
 
+        # Compare raw POSIX timestamps; a datetime is only needed for the formatted date
         next_run_ts = self.config['next_run_timestamp_gmt']
-        next_run_dt = datetime.fromtimestamp(next_run_ts, timezone.utc)
-        now = datetime.now(timezone.utc)
-        
-        if next_run_dt <= now:
+        seconds_left = int(next_run_ts - time.time())
+
+        if seconds_left <= 0:
             await interaction.followup.send(
                 "⏳ The leaderboard job is currently overdue or running. It will be scheduled for the following Sunday (4:30 AM GMT) shortly after completion."
             )
             return
 
-        time_left: timedelta = next_run_dt - now
-        
-        days = time_left.days
-        hours = time_left.seconds // 3600
-        minutes = (time_left.seconds % 3600) // 60
-        seconds = time_left.seconds % 60
+        next_run_dt = datetime.fromtimestamp(next_run_ts, UTC)
+        days, seconds_left = divmod(seconds_left, 86400)
+        hours, seconds_left = divmod(seconds_left, 3600)
+        minutes, seconds = divmod(seconds_left, 60)
         
         countdown_msg = (
             f"📅 **Time until next automatic leaderboard update:**\n"
@@ -395,8 +858,12 @@ Top 1 can change their server nickname once. Top 1 & 2 can have a custom role wi
 
 bot = LeaderboardClient(intents=intents)
 
-# Run the bot (Token must be provided)
-if TOKEN and TOKEN != 'YOUR_BOT_TOKEN_HERE':
-    bot.run(TOKEN)
-else:
-    print("Bot execution skipped. Please provide a valid DISCORD_BOT_TOKEN.")
\ No newline at end of file
+# Run the bot (Token must be provided). Logging is already configured, so discord.py must not add its own handler.
+try:
+    if TOKEN and TOKEN != 'YOUR_BOT_TOKEN_HERE':
+        bot.run(TOKEN, log_handler=None)
+    else:
+        log.warning("Bot execution skipped. Please provide a valid DISCORD_BOT_TOKEN.")
+finally:
+    # Flush any queued records before exiting
+    log_listener.stop()